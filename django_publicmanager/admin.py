@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+import re
+from django.contrib.admin.filterspecs import FilterSpec
+from django.contrib.admin.options import IncorrectLookupParameters
+from django.contrib.admin.views.main import ChangeList
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connections
+from django.db.models.query import EmptyQuerySet
+from django.db.models.sql.datastructures import EmptyResultSet
+from django.utils.translation import ugettext as _
+from django_publicmanager.queryset import PublicQuerySet, VISIBILITIES
+
+
+VISIBILITY_VAR = 'visibility'
+
+
+def estimate_count(queryset):
+    '''
+    Returns the number of rows the database planner expects for
+    ``queryset`` without executing it. This is only supported on PostgreSQL,
+    ``None`` is returned for other databases.
+    '''
+    if isinstance(queryset, EmptyQuerySet):
+        return 0
+    connection = connections[queryset.db]
+    if 'postgresql' not in connection.settings_dict['ENGINE']:
+        return None
+    try:
+        sql, params = queryset.order_by().query.get_compiler(queryset.db).as_sql()
+    except EmptyResultSet:
+        return 0
+    cursor = connection.cursor()
+    cursor.execute('EXPLAIN ' + sql, params)
+    match = re.search(r'rows=(\d+)', cursor.fetchone()[0])
+    if match is None:
+        return None
+    return int(match.group(1))
+
+
+class VisibilityFilterSpec(FilterSpec):
+    '''
+    Filter for the changelist of a ``VisibilityAdminMixin`` that lists the
+    public, scheduled and hidden objects together with their number.
+    '''
+    def __init__(self, f, request, params, model, model_admin):
+        super(VisibilityFilterSpec, self).__init__(f, request, params, model, model_admin)
+        self.lookup_val = request.GET.get(VISIBILITY_VAR, None)
+
+    def title(self):
+        return _('visibility')
+
+    def choices(self, cl):
+        counts, estimated = cl.get_visibility_counts()
+        yield {'selected': self.lookup_val is None,
+               'query_string': cl.get_query_string({}, [VISIBILITY_VAR]),
+               'display': _('All')}
+        for name in VISIBILITIES:
+            if estimated:
+                display = u'%s (~%d)' % (_(name), counts[name])
+            else:
+                display = u'%s (%d)' % (_(name), counts[name])
+            yield {'selected': self.lookup_val == name,
+                   'query_string': cl.get_query_string({VISIBILITY_VAR: name}),
+                   'display': display}
+
+
+class VisibilityChangeList(ChangeList):
+    '''
+    ``ChangeList`` that handles the ``visibility`` query parameter and adds
+    the ``VisibilityFilterSpec`` in front of the other filters.
+    '''
+    def get_query_set(self):
+        self.visibility = self.params.pop(VISIBILITY_VAR, None)
+        try:
+            qs = super(VisibilityChangeList, self).get_query_set()
+        finally:
+            if self.visibility is not None:
+                self.params[VISIBILITY_VAR] = self.visibility
+        # The counts of the filter include all other filters but not the
+        # visibility itself.
+        self.visibility_query_set = qs
+        if self.visibility is not None:
+            if self.visibility not in VISIBILITIES:
+                raise IncorrectLookupParameters
+            qs = qs.visibility(self.visibility)
+        return qs
+
+    def get_filters(self, request):
+        filter_specs, has_filters = super(VisibilityChangeList, self).get_filters(request)
+        filter_specs.insert(0, VisibilityFilterSpec(None, request,
+            self.params, self.model, self.model_admin))
+        return filter_specs, True
+
+    def get_visibility_counts(self):
+        if not hasattr(self, '_visibility_counts'):
+            self._visibility_counts = self.model_admin.get_visibility_counts(
+                self.visibility_query_set)
+        return self._visibility_counts
+
+
+class VisibilityAdminMixin(object):
+    '''
+    Mixin for ``ModelAdmin`` classes of models that use a
+    ``GenericPublicManager``. The changelist gets a filter for public,
+    scheduled and hidden objects. The numbers of objects shown in the filter
+    are retrieved with a single grouped query.
+
+    The manager given by ``visibility_manager`` is used for the changelist,
+    the model's default manager if it's ``None``. Set ``visibility_estimate``
+    to ``True`` to show the planner's estimates instead of exact numbers on
+    PostgreSQL.
+    '''
+    visibility_manager = None
+    visibility_estimate = False
+
+    def queryset(self, request):
+        if self.visibility_manager is None:
+            qs = super(VisibilityAdminMixin, self).queryset(request)
+        else:
+            qs = getattr(self.model, self.visibility_manager).get_query_set()
+            ordering = self.ordering or ()
+            if ordering:
+                qs = qs.order_by(*ordering)
+        if not isinstance(qs, PublicQuerySet):
+            raise ImproperlyConfigured('%s needs a GenericPublicManager. '
+                'Set visibility_manager to the name of such a manager of %s.' % (
+                    self.__class__.__name__, self.model.__name__))
+        return qs
+
+    def get_changelist(self, request, **kwargs):
+        return VisibilityChangeList
+
+    def get_visibility_counts(self, queryset):
+        '''
+        Returns a dictionary with the number of ``public``, ``scheduled`` and
+        ``hidden`` objects in ``queryset`` and a flag if these are estimates.
+        '''
+        if self.visibility_estimate:
+            counts = {}
+            for name in VISIBILITIES:
+                counts[name] = estimate_count(queryset.visibility(name))
+            if None not in counts.values():
+                return counts, True
+        return queryset.visibility_counts(), False
@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+from django.contrib.syndication.views import Feed
+
+
+class PublicFeed(Feed):
+    '''
+    Feed of the latest public objects of ``manager``, which must be a
+    ``GenericPublicManager`` or ``PublicOnlyManager``. The objects are ordered
+    by their ``pub_date`` which is also used as publication date of the feed
+    items. Only ``limit`` objects are fetched from the database.
+
+    Subclasses must provide ``title``, ``link`` and ``description`` like for
+    every other django feed.
+    '''
+    manager = None
+    limit = 30
+
+    def items(self):
+        queryset = self.manager.public()
+        if queryset.pub_date_attr:
+            queryset = queryset.order_by('-' + queryset.pub_date_attr, '-pk')
+        else:
+            queryset = queryset.order_by('-pk')
+        return queryset[:self.limit]
+
+    def item_pubdate(self, item):
+        pub_date_attr = self.manager.public().pub_date_attr
+        if pub_date_attr:
+            return getattr(item, pub_date_attr)
+        return None
@@ -36,6 +36,15 @@ class GenericPublicManager(models.Manager):
     def public(self, *args, **kwargs):
         return self.get_query_set().public(*args, **kwargs)
 
+    def scheduled(self, *args, **kwargs):
+        return self.get_query_set().scheduled(*args, **kwargs)
+
+    def hidden(self, *args, **kwargs):
+        return self.get_query_set().hidden(*args, **kwargs)
+
+    def visibility_counts(self, *args, **kwargs):
+        return self.get_query_set().visibility_counts(*args, **kwargs)
+
 
 class PublicOnlyManager(GenericPublicManager):
     '''
@@ -1,10 +1,13 @@
 # -*- coding: utf-8 -*-
 from datetime import datetime
-from django.db import models
+from django.db import connections, models
 from django.db.models.fields import FieldDoesNotExist
 from django.db.models.query import QuerySet
 
 
+VISIBILITIES = ('public', 'scheduled', 'hidden')
+
+
 class PublicQuerySet(QuerySet):
     is_public_attr = None
     pub_date_attr = None
@@ -37,6 +40,14 @@ class PublicQuerySet(QuerySet):
             except FieldDoesNotExist:
                 pass
 
+    def _visible(self):
+        clone = self._clone()
+        if self.is_public_attr:
+            clone = clone.filter(**{self.is_public_attr: True})
+        if self.status_attr and self.status_values:
+            clone = clone.filter(**{self.status_attr + '__in': self.status_values})
+        return clone
+
     def public(self):
         '''
         The following conditions must be true:
@@ -45,16 +56,102 @@ class PublicQuerySet(QuerySet):
             * pub_date must be ``None`` or greater/equal datetime.now()
             * status must be in ``self.status_values``
         '''
-        clone = self._clone()
-        if self.is_public_attr:
-            clone = clone.filter(**{self.is_public_attr: True})
+        clone = self._visible()
         if self.pub_date_attr:
             query = models.Q(**{self.pub_date_attr + '__lte': datetime.now()}) | models.Q(**{self.pub_date_attr: None})
             clone = clone.filter(query)
-        if self.status_attr and self.status_values:
-            clone = clone.filter(**{self.status_attr + '__in': self.status_values})
         return clone
 
+    def scheduled(self):
+        '''
+        Returns the objects that fulfill the ``is_public`` and ``status``
+        conditions but whose pub_date is still in the future.
+        '''
+        if not self.pub_date_attr:
+            return self.none()
+        return self._visible().filter(
+            **{self.pub_date_attr + '__gt': datetime.now()})
+
+    def hidden(self):
+        '''
+        Returns the objects that fail the ``is_public`` or ``status``
+        condition.
+        '''
+        conditions = {}
+        if self.is_public_attr:
+            conditions[self.is_public_attr] = True
+        if self.status_attr and self.status_values:
+            conditions[self.status_attr + '__in'] = self.status_values
+        if not conditions:
+            return self.none()
+        return self.exclude(**conditions)
+
+    def visibility(self, name):
+        '''
+        Returns the ``public``, ``scheduled`` or ``hidden`` objects.
+        '''
+        if name not in VISIBILITIES:
+            raise ValueError('Unknown visibility %r.' % name)
+        return getattr(self, name)()
+
+    def _visibility_sql(self):
+        '''
+        Returns a SQL expression and its parameters that evaluates to the
+        visibility of a row. It mirrors ``public()``, ``scheduled()`` and
+        ``hidden()``.
+        '''
+        connection = connections[self.db]
+        qn = connection.ops.quote_name
+        opts = self.model._meta
+        def column(attr):
+            field = opts.get_field(attr)
+            return field, '%s.%s' % (qn(opts.db_table), qn(field.column))
+        conditions, params = [], []
+        if self.is_public_attr:
+            field, col = column(self.is_public_attr)
+            conditions.append('%s IS NULL OR %s <> %%s' % (col, col))
+            params.extend(field.get_db_prep_lookup('exact', True,
+                connection=connection))
+        if self.status_attr and self.status_values:
+            field, col = column(self.status_attr)
+            values = field.get_db_prep_lookup('in', self.status_values,
+                connection=connection)
+            conditions.append('%s IS NULL OR %s NOT IN (%s)' % (
+                col, col, ', '.join(['%s'] * len(values))))
+            params.extend(values)
+        sql = ['CASE']
+        if conditions:
+            sql.append('WHEN (%s) THEN %%s' % ') OR ('.join(conditions))
+            params.append('hidden')
+        if self.pub_date_attr:
+            field, col = column(self.pub_date_attr)
+            sql.append('WHEN %s > %%s THEN %%s' % col)
+            params.extend(field.get_db_prep_lookup('gt', datetime.now(),
+                connection=connection))
+            params.append('scheduled')
+        sql.append('ELSE %s END')
+        params.append('public')
+        return ' '.join(sql), params
+
+    def visibility_counts(self):
+        '''
+        Returns a dictionary with the number of ``public``, ``scheduled`` and
+        ``hidden`` objects. All three are counted with one grouped query.
+        '''
+        counts = dict.fromkeys(VISIBILITIES, 0)
+        if not (self.is_public_attr or self.pub_date_attr or
+                (self.status_attr and self.status_values)):
+            counts['public'] = self.count()
+            return counts
+        sql, params = self._visibility_sql()
+        # Joins of the queryset may return an object more than once.
+        count = models.Count('pk', distinct=True)
+        rows = self.extra(select={'visibility': sql}, select_params=params) \
+            .values('visibility').annotate(count=count).order_by()
+        for row in rows:
+            counts[row['visibility']] = row['count']
+        return counts
+
     def _clone(self, *args, **kwargs):
         clone = super(PublicQuerySet, self)._clone(*args, **kwargs)
         for attr in (
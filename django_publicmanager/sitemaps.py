@@ -0,0 +1,416 @@
+# -*- coding: utf-8 -*-
+import bisect
+import itertools
+import os
+from datetime import datetime, timedelta
+from xml.sax.saxutils import escape
+from django.contrib.sitemaps import Sitemap
+from django.contrib.sites.models import Site
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connections, models
+from django.utils import simplejson
+from django.utils.encoding import force_unicode, smart_str
+
+
+class PublicSitemap(Sitemap):
+    '''
+    Sitemap of all public objects of a ``GenericPublicManager`` or
+    ``PublicOnlyManager``. The public objects are retrieved from the manager
+    every time ``items()`` is called, so objects with a ``pub_date`` in the
+    future show up as soon as they get public.
+
+    ``modified_attr`` may name a field that is updated on every change of an
+    object. It is used for the ``lastmod`` value and by ``write_sitemap`` to
+    find changed shards without checking every shard. The manager's
+    ``pub_date_attr`` is used for ``lastmod`` if no ``modified_attr`` is
+    given.
+
+    Use ``write_sitemap`` to write the sitemap into static files. It needs a
+    model with an integer primary key.
+    '''
+    # Number of urls written into a new shard by ``write_sitemap``. The gap
+    # to ``limit`` leaves room for objects that get public later inside the
+    # shard.
+    shard_size = 40000
+    # Number of objects fetched at once by ``write_sitemap``.
+    chunk_size = 1000
+    # Overlap of the time windows checked by consecutive ``write_sitemap``
+    # runs. ``auto_now`` fields are set before the transaction commits, so
+    # objects may show up with a ``modified_attr`` earlier than the last run.
+    watermark_lag = timedelta(minutes=5)
+
+    def __init__(self, manager, changefreq=None, priority=None,
+            modified_attr=None):
+        self.manager = manager
+        self.changefreq = changefreq
+        self.priority = priority
+        self.modified_attr = modified_attr
+
+    def items(self):
+        return self.manager.public().order_by('pk')
+
+    def get_watermark_attr(self):
+        return self.modified_attr or self.manager.public().pub_date_attr
+
+    def lastmod(self, item):
+        attr = self.get_watermark_attr()
+        if attr:
+            return getattr(item, attr)
+        return None
+
+
+def _get(sitemap, name, item):
+    attr = getattr(sitemap, name, None)
+    if callable(attr):
+        return attr(item)
+    return attr
+
+
+def _iter_chunked(queryset, chunk_size, after=None):
+    '''
+    Yields the objects of ``queryset`` ordered by primary key, starting after
+    the primary key ``after``. Only ``chunk_size`` objects are loaded at once.
+    '''
+    while True:
+        chunk = queryset.order_by('pk')
+        if after is not None:
+            chunk = chunk.filter(pk__gt=after)
+        chunk = list(chunk[:chunk_size])
+        for item in chunk:
+            yield item
+        if len(chunk) < chunk_size:
+            break
+        after = chunk[-1].pk
+
+
+# Modulus for the squares of the primary keys in the signature of a shard.
+# The squares stay below 2 ** 31, so they don't overflow an integer column.
+_SQUARE_MODULUS = 46337
+
+
+def _get_signature(queryset, watermark_attr, after, last):
+    '''
+    Returns the signature of the objects in ``queryset`` whose primary key
+    is between ``after`` (exclusive) and ``last`` (inclusive). The signature
+    is a dictionary with the number of objects, the sum of their primary
+    keys, the sum of their squared primary keys (modulo ``_SQUARE_MODULUS``)
+    and their latest watermark. The two sums differ for different sets of
+    objects of the same size unless they are constructed on purpose.
+    '''
+    queryset = queryset.filter(pk__lte=last)
+    if after is not None:
+        queryset = queryset.filter(pk__gt=after)
+    qn = connections[queryset.db].ops.quote_name
+    opts = queryset.model._meta
+    def column(field):
+        return '%s.%s' % (qn(opts.db_table), qn(field.column))
+    pk = column(opts.pk)
+    # Django's aggregates can't sum expressions, so all values are selected
+    # with ``extra`` in a single query.
+    select = {
+        'count': 'COUNT(%s)' % pk,
+        'pk_sum': 'SUM(%s)' % pk,
+        'pk_square_sum': 'SUM((%s %%%% %d) * (%s %%%% %d))' % (
+            pk, _SQUARE_MODULUS, pk, _SQUARE_MODULUS),
+    }
+    if watermark_attr:
+        select['watermark'] = 'MAX(%s)' % column(opts.get_field(watermark_attr))
+    result = queryset.order_by().extra(select=select).values(*select)[0]
+    signature = {'count': int(result['count'])}
+    for key in ('pk_sum', 'pk_square_sum'):
+        signature[key] = result[key] is not None and int(result[key]) or None
+    signature['watermark'] = None
+    if result.get('watermark') is not None:
+        signature['watermark'] = force_unicode(result['watermark'])
+    return signature
+
+
+def _get_after(shards, index):
+    if index:
+        return shards[index - 1]['last']
+    return None
+
+
+def _find_changed_shards(queryset, modified_attr, shards, since, now):
+    '''
+    Returns the indexes of the shards that hold objects whose
+    ``modified_attr`` is later than ``since`` or whose ``pub_date`` passed
+    between ``since`` and ``now``. Hidden objects are included, since they
+    might have been public before.
+    '''
+    query = models.Q(**{modified_attr + '__gt': since})
+    if queryset.pub_date_attr:
+        query |= models.Q(**{
+            queryset.pub_date_attr + '__gt': since,
+            queryset.pub_date_attr + '__lte': now})
+    lasts = [shard['last'] for shard in shards]
+    candidates = queryset.model._base_manager.filter(query,
+        pk__lte=lasts[-1]).order_by('pk')
+    changed = set()
+    after = None
+    while True:
+        chunk = candidates
+        if after is not None:
+            chunk = chunk.filter(pk__gt=after)
+        pks = list(chunk.values_list('pk', flat=True)[:1])
+        if not pks:
+            break
+        index = bisect.bisect_left(lasts, pks[0])
+        changed.add(index)
+        # Skip the remaining objects of this shard.
+        after = lasts[index]
+    return changed
+
+
+def _find_shrunk_shards(queryset, shards, counts, start, end, found):
+    '''
+    Adds the indexes of the shards between ``start`` and ``end`` that hold
+    fewer objects than given in ``counts`` to ``found``. The range is halved
+    as long as objects are missing in it, so only one query is needed if no
+    objects were deleted.
+    '''
+    objects = queryset.filter(pk__lte=shards[end - 1]['last'])
+    after = _get_after(shards, start)
+    if after is not None:
+        objects = objects.filter(pk__gt=after)
+    if objects.order_by().count() >= sum(counts[start:end]):
+        return
+    if end - start == 1:
+        found.add(start)
+        return
+    middle = (start + end) // 2
+    _find_shrunk_shards(queryset, shards, counts, start, middle, found)
+    _find_shrunk_shards(queryset, shards, counts, middle, end, found)
+
+
+def _render_url(sitemap, site, item):
+    location = 'http://%s%s' % (site.domain, _get(sitemap, 'location', item))
+    parts = [u'<url><loc>%s</loc>' % escape(force_unicode(location))]
+    lastmod = _get(sitemap, 'lastmod', item)
+    if lastmod:
+        parts.append(u'<lastmod>%s</lastmod>' % lastmod.strftime('%Y-%m-%d'))
+    changefreq = _get(sitemap, 'changefreq', item)
+    if changefreq:
+        parts.append(u'<changefreq>%s</changefreq>' % changefreq)
+    priority = _get(sitemap, 'priority', item)
+    if priority is not None:
+        parts.append(u'<priority>%s</priority>' % priority)
+    parts.append(u'</url>\n')
+    return smart_str(u''.join(parts))
+
+
+def _write_file(path, header, lines, footer):
+    '''
+    Writes ``lines`` between ``header`` and ``footer`` into ``path``. The
+    file is replaced atomically.
+    '''
+    tmp_path = path + '.tmp'
+    f = open(tmp_path, 'w')
+    try:
+        f.write(header)
+        for line in lines:
+            f.write(line)
+        f.write(footer)
+    finally:
+        f.close()
+    os.rename(tmp_path, path)
+
+
+def _write_shard(path, sitemap, site, items):
+    '''
+    Writes the urls of ``items`` into the sitemap file ``path``. Returns the
+    last written object.
+    '''
+    written = {}
+    def lines():
+        for item in items:
+            written['last'] = item
+            yield _render_url(sitemap, site, item)
+    _write_file(path,
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        '<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">\n',
+        lines(),
+        '</urlset>\n')
+    return written.get('last')
+
+
+_TIME_FORMAT = '%Y-%m-%d %H:%M:%S.%f'
+
+
+def _load_state(path):
+    '''
+    Returns the time of the last run and the shards stored in ``path``.
+    '''
+    if not os.path.exists(path):
+        return None, []
+    f = open(path)
+    try:
+        state = simplejson.load(f)
+    finally:
+        f.close()
+    since = state.get('since')
+    if since is not None:
+        since = datetime.strptime(since, _TIME_FORMAT)
+    return since, state['shards']
+
+
+def _save_state(path, since, shards):
+    _write_file(path, '', [simplejson.dumps({
+        'since': since.strftime(_TIME_FORMAT),
+        'shards': shards,
+    })], '')
+
+
+def write_sitemap(sitemap, directory, base_url, name='sitemap', site=None):
+    '''
+    Writes ``sitemap`` into the shards ``<name>-<id>.xml`` in ``directory``
+    and an index file ``<name>.xml`` that points to the shards below
+    ``base_url``. The objects are streamed from the database in chunks of
+    ``sitemap.chunk_size``, so memory usage doesn't grow with the number of
+    objects.
+
+    The shards are ranges of primary keys. Their boundaries and ids are kept
+    in ``<name>.json`` together with a signature of every shard: the number
+    of public objects, the sum of their primary keys and of their squares
+    and the latest watermark (``modified_attr`` or ``pub_date``). On later
+    runs a shard is only written again if its signature changed. New
+    objects are appended to the last shard until it holds
+    ``sitemap.shard_size`` urls. A shard that gets empty is removed and its
+    range is merged into the following shard. A shard that exceeds
+    ``sitemap.limit`` is split up into new shards. The ids of the other
+    shards stay the same, so their files are kept.
+
+    The time of the run minus ``sitemap.watermark_lag`` is kept in
+    ``<name>.json`` as well. If the sitemap has a ``modified_attr``, the next
+    run only computes the signatures of the shards that hold objects
+    modified since then or whose ``pub_date`` passed since then. Deleted
+    objects are found by counting the public objects of all shards at once;
+    only if this count dropped, the range is halved to find the affected
+    shards. Without a ``modified_attr`` changes of ``is_public`` or
+    ``status`` can't be detected by time, so every shard is checked with
+    one aggregate query per run.
+
+    The model needs an integer primary key. ``ImproperlyConfigured`` is
+    raised otherwise.
+
+    Returns the list of written shard filenames.
+    '''
+    pk_field = sitemap.items().model._meta.pk
+    if not isinstance(pk_field, (models.AutoField, models.IntegerField)):
+        raise ImproperlyConfigured('write_sitemap needs an integer primary '
+            'key, %s has a %s.' % (pk_field.model.__name__,
+                pk_field.__class__.__name__))
+    if site is None:
+        site = Site.objects.get_current()
+    state_path = os.path.join(directory, name + '.json')
+    shard_filename = lambda shard_id: '%s-%d.xml' % (name, shard_id)
+    now = datetime.now()
+    since, shards = _load_state(state_path)
+    for index, shard in enumerate(shards):
+        # States written before shards had ids named the files by position.
+        shard.setdefault('id', index + 1)
+    new_ids = itertools.count(
+        max([0] + [shard['id'] for shard in shards]) + 1)
+    # Keep the time used for the public filter constant during the run.
+    queryset = sitemap.items()
+    watermark_attr = sitemap.get_watermark_attr()
+    written = []
+
+    def write_shards(after, last, shard_id):
+        '''
+        Writes the objects between ``after`` and ``last`` into shards of
+        ``sitemap.shard_size`` urls. The first one gets ``shard_id`` or a new
+        id, the following ones new ids. Returns the new shards.
+        '''
+        objects = queryset
+        if last is not None:
+            objects = objects.filter(pk__lte=last)
+        objects = _iter_chunked(objects, sitemap.chunk_size, after)
+        new_shards = []
+        for first in objects:
+            if shard_id is None:
+                shard_id = new_ids.next()
+            filename = shard_filename(shard_id)
+            last_object = _write_shard(os.path.join(directory, filename),
+                sitemap, site, itertools.chain([first],
+                    itertools.islice(objects, sitemap.shard_size - 1)))
+            shard = {'id': shard_id, 'last': last_object.pk}
+            shard.update(_get_signature(queryset, watermark_attr,
+                after, last_object.pk))
+            new_shards.append(shard)
+            written.append(filename)
+            after = last_object.pk
+            shard_id = None
+        if new_shards and last is not None:
+            # The last shard keeps covering the whole range.
+            new_shards[-1]['last'] = last
+        return new_shards
+
+    split_from = len(shards)
+    if shards and shards[-1]['count'] < sitemap.shard_size and \
+            queryset.filter(pk__gt=shards[-1]['last']).exists():
+        split_from -= 1
+
+    # Indexes of the shards that need to be checked, ``None`` for all.
+    checked = None
+    signatures = {}
+    if since is not None and sitemap.modified_attr and split_from:
+        checked = _find_changed_shards(queryset, sitemap.modified_attr,
+            shards[:split_from], since, now)
+        counts = [shard['count'] for shard in shards[:split_from]]
+        for index in checked:
+            signatures[index] = _get_signature(queryset, watermark_attr,
+                _get_after(shards, index), shards[index]['last'])
+            counts[index] = signatures[index]['count']
+        _find_shrunk_shards(queryset, shards, counts, 0, split_from, checked)
+
+    new_shards = []
+    after = None
+    for index, shard in enumerate(shards[:split_from]):
+        if checked is not None and index not in checked:
+            new_shards.append(shard)
+            after = shard['last']
+            continue
+        signature = signatures.get(index)
+        if signature is None:
+            signature = _get_signature(queryset, watermark_attr,
+                after, shard['last'])
+        if not signature['count']:
+            # The following shard takes over the range, ``after`` stays.
+            continue
+        if signature['count'] > sitemap.limit:
+            new_shards.extend(write_shards(after, shard['last'], shard['id']))
+        elif [signature[key] for key in signature] != \
+                [shard.get(key) for key in signature]:
+            filename = shard_filename(shard['id'])
+            _write_shard(os.path.join(directory, filename), sitemap, site,
+                _iter_chunked(queryset.filter(pk__lte=shard['last']),
+                    sitemap.chunk_size, after))
+            shard.update(signature)
+            new_shards.append(shard)
+            written.append(filename)
+        else:
+            new_shards.append(shard)
+        after = shard['last']
+
+    # The last shard is extended by the new objects if it isn't full yet.
+    tail_id = None
+    if shards[split_from:]:
+        tail_id = shards[split_from]['id']
+    new_shards.extend(write_shards(after, None, tail_id))
+
+    kept_ids = set([shard['id'] for shard in new_shards])
+    for shard in shards:
+        path = os.path.join(directory, shard_filename(shard['id']))
+        if shard['id'] not in kept_ids and os.path.exists(path):
+            os.remove(path)
+
+    _write_file(os.path.join(directory, name + '.xml'),
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        '<sitemapindex xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">\n',
+        [smart_str(u'<sitemap><loc>%s</loc></sitemap>\n' %
+            escape(force_unicode(base_url + shard_filename(shard['id']))))
+            for shard in new_shards],
+        '</sitemapindex>\n')
+    _save_state(state_path, now - sitemap.watermark_lag, new_shards)
+    return written
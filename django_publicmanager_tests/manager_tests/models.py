@@ -16,6 +16,14 @@ class PublicDefault(models.Model):
         return unicode(self.pk)
 
 
+class Tag(models.Model):
+    name = models.CharField(max_length=50)
+    obj = models.ForeignKey(PublicDefault, related_name='tags')
+
+    def __unicode__(self):
+        return self.name
+
+
 class PublicNonDefault(models.Model):
     active = models.BooleanField(default=True)
     release_date = models.DateField(default=datetime.utcnow)
@@ -32,6 +40,18 @@ class PublicNonDefault(models.Model):
         return unicode(self.pk)
 
 
+class PublicModified(models.Model):
+    is_public = models.BooleanField(default=True)
+    pub_date = models.DateTimeField(default=datetime.utcnow)
+    modified = models.DateTimeField(auto_now=True)
+
+    objects = models.Manager()
+    public = PublicOnlyManager()
+
+    def __unicode__(self):
+        return unicode(self.pk)
+
+
 class IsPublic(models.Model):
     is_public = models.BooleanField(default=True)
 
@@ -1,10 +1,26 @@
 # -*- coding: utf-8 -*-
+import os
+import shutil
+import tempfile
 from datetime import datetime, timedelta
-from django.db import models
+from django.conf import settings
+from django.contrib import admin
+from django.contrib.admin.options import IncorrectLookupParameters
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connection, models
+from django.http import HttpRequest
 from django.test import TestCase
+from django.utils import simplejson
+from django_publicmanager import admin as publicmanager_admin
+from django_publicmanager.admin import (
+    VisibilityAdminMixin, VisibilityChangeList, VisibilityFilterSpec,
+    estimate_count)
+from django_publicmanager.feeds import PublicFeed
 from django_publicmanager.queryset import PublicQuerySet
+from django_publicmanager.sitemaps import PublicSitemap, write_sitemap
 from django_publicmanager_tests.manager_tests.models import (
-    PublicDefault, PublicNonDefault, IsPublic, PubDate, PublicStatus)
+    PublicDefault, PublicNonDefault, PublicModified, IsPublic, PubDate,
+    PublicStatus, Tag)
 
 
 class DefaultTestCase(TestCase):
@@ -153,6 +169,69 @@ class TestGenericPublicManager(DefaultTestCase):
         self.assertEqual(1, len(qs))
 
 
+class TestVisibility(DefaultTestCase):
+    def test_default_attr_names(self):
+        self.assertEqual(
+            set(PublicDefault.objects.filter(is_public=True,
+                pub_date__gt=datetime.utcnow())),
+            set(PublicDefault.generic.scheduled()))
+        self.assertEqual(
+            set(PublicDefault.objects.filter(is_public=False)),
+            set(PublicDefault.generic.hidden()))
+        self.assertEqual(
+            {'public': 1, 'scheduled': 1, 'hidden': 2},
+            PublicDefault.generic.visibility_counts())
+
+    def test_nondefault_attr_names(self):
+        self.assertEqual(1, len(PublicNonDefault.generic.scheduled()))
+        self.assertEqual(2, len(PublicNonDefault.generic.hidden()))
+        self.assertEqual(
+            {'public': 1, 'scheduled': 1, 'hidden': 2},
+            PublicNonDefault.generic.visibility_counts())
+
+    def test_only_is_public_attr(self):
+        self.assertEqual(0, len(IsPublic.generic.scheduled()))
+        self.assertEqual(
+            set(IsPublic.objects.filter(is_public=False)),
+            set(IsPublic.generic.hidden()))
+        self.assertEqual(
+            {'public': 2, 'scheduled': 0, 'hidden': 2},
+            IsPublic.generic.visibility_counts())
+
+    def test_only_pub_date_attr(self):
+        self.assertEqual(
+            set(PubDate.objects.filter(pub_date__gt=datetime.utcnow())),
+            set(PubDate.generic.scheduled()))
+        self.assertEqual(0, len(PubDate.generic.hidden()))
+        self.assertEqual(
+            {'public': 2, 'scheduled': 2, 'hidden': 0},
+            PubDate.generic.visibility_counts())
+
+    def test_status(self):
+        self.assertEqual(0, len(PublicStatus.generic.scheduled()))
+        self.assertEqual(
+            set(PublicStatus.objects.exclude(
+                status__in=PublicStatus.PUBLIC_STATUS)),
+            set(PublicStatus.generic.hidden()))
+        self.assertEqual(
+            {'public': 2, 'scheduled': 0, 'hidden': 2},
+            PublicStatus.generic.visibility_counts())
+
+    def test_filtered_counts(self):
+        qs = PublicDefault.generic.filter(is_public=True)
+        self.assertEqual(
+            {'public': 1, 'scheduled': 1, 'hidden': 0},
+            qs.visibility_counts())
+
+    def test_visibility(self):
+        for name in ('public', 'scheduled', 'hidden'):
+            self.assertEqual(
+                set(getattr(PublicDefault.generic, name)()),
+                set(PublicDefault.generic.all().visibility(name)))
+        self.assertRaises(ValueError,
+            PublicDefault.generic.all().visibility, 'unknown')
+
+
 class TestPublicOnlyManager(DefaultTestCase):
     def test_default_attr_names(self):
         qs = PublicDefault.public.all()
@@ -190,3 +269,466 @@ class TestPublicOnlyManager(DefaultTestCase):
             set(PublicStatus.objects.filter(status__in=PublicStatus.PUBLIC_STATUS)),
             set(qs))
         self.assertEqual(2, len(qs))
+
+
+class ExampleSitemap(PublicSitemap):
+    limit = 3
+    shard_size = 2
+    chunk_size = 2
+
+    def location(self, obj):
+        return '/example/%d/' % obj.pk
+
+
+class TestPublicSitemap(DefaultTestCase):
+    def setUp(self):
+        super(TestPublicSitemap, self).setUp()
+        for i in range(4):
+            PublicDefault(None, True, self.past_date).save()
+        self.sitemap = ExampleSitemap(PublicDefault.generic)
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self):
+        return write_sitemap(self.sitemap, self.directory,
+            'http://example.com/sitemaps/')
+
+    def read(self, filename):
+        f = open(os.path.join(self.directory, filename))
+        try:
+            return f.read()
+        finally:
+            f.close()
+
+    def read_urls(self, filename):
+        content = self.read(filename)
+        return [url.split('</loc>')[0] for url in content.split('<loc>')[1:]]
+
+    def url(self, obj):
+        return 'http://example.com/example/%d/' % obj.pk
+
+    def publish(self, obj):
+        obj.is_public = True
+        obj.pub_date = self.past_date
+        obj.save()
+
+    def test_items(self):
+        self.assertEqual(
+            list(PublicDefault.generic.public().order_by('pk')),
+            list(self.sitemap.items()))
+        self.assertEqual(5, len(self.sitemap.items()))
+
+    def test_write_shards(self):
+        self.assertEqual(
+            ['sitemap-1.xml', 'sitemap-2.xml', 'sitemap-3.xml'],
+            self.write())
+        self.assertEqual([
+            'http://example.com/sitemaps/sitemap-1.xml',
+            'http://example.com/sitemaps/sitemap-2.xml',
+            'http://example.com/sitemaps/sitemap-3.xml',
+        ], self.read_urls('sitemap.xml'))
+        objects = list(PublicDefault.generic.public().order_by('pk'))
+        self.assertEqual(
+            [self.url(obj) for obj in objects[0:2]],
+            self.read_urls('sitemap-1.xml'))
+        self.assertEqual(
+            [self.url(obj) for obj in objects[2:4]],
+            self.read_urls('sitemap-2.xml'))
+        self.assertEqual(
+            [self.url(obj) for obj in objects[4:]],
+            self.read_urls('sitemap-3.xml'))
+
+    def test_unchanged(self):
+        self.write()
+        self.assertEqual([], self.write())
+
+    def test_unpublished_object(self):
+        self.write()
+        obj = PublicDefault.generic.public().order_by('pk')[0]
+        obj.is_public = False
+        obj.save()
+        self.assertEqual(['sitemap-1.xml'], self.write())
+        self.assertFalse(self.url(obj) in self.read_urls('sitemap-1.xml'))
+
+    def test_swapped_objects(self):
+        self.write()
+        objects = list(PublicDefault.objects.order_by('pk'))
+        # the first shard holds the fourth and fifth object
+        unpublished = objects[3]
+        unpublished.is_public = False
+        unpublished.save()
+        published = objects[1]
+        self.publish(published)
+        self.assertEqual(['sitemap-1.xml'], self.write())
+        urls = self.read_urls('sitemap-1.xml')
+        self.assertFalse(self.url(unpublished) in urls)
+        self.assertTrue(self.url(published) in urls)
+
+    def test_double_swapped_objects(self):
+        # pk 2 + 6 == pk 3 + 5, so the sum of the pks doesn't change
+        for i in range(2):
+            PublicDefault(None, True, self.past_date).save()
+        PublicDefault.objects.update(is_public=True, pub_date=self.past_date)
+        PublicDefault.objects.filter(pk__in=[3, 5]).update(is_public=False)
+        self.sitemap.limit = self.sitemap.shard_size = 10
+        self.write()
+        PublicDefault.objects.filter(pk__in=[2, 6]).update(is_public=False)
+        PublicDefault.objects.filter(pk__in=[3, 5]).update(is_public=True)
+        self.assertEqual(['sitemap-1.xml'], self.write())
+        urls = self.read_urls('sitemap-1.xml')
+        for obj in PublicDefault.objects.all():
+            self.assertEqual(obj.is_public, self.url(obj) in urls)
+
+    def test_scheduled_object(self):
+        self.write()
+        # the hidden objects are all inside the range of the first shard
+        obj = PublicDefault.objects.get(is_public=True,
+            pub_date=self.future_date)
+        self.publish(obj)
+        self.assertEqual(['sitemap-1.xml'], self.write())
+        self.assertTrue(self.url(obj) in self.read_urls('sitemap-1.xml'))
+
+    def test_new_object(self):
+        self.write()
+        obj = PublicDefault.objects.create(is_public=True,
+            pub_date=self.past_date)
+        self.assertEqual(['sitemap-3.xml'], self.write())
+        self.assertTrue(self.url(obj) in self.read_urls('sitemap-3.xml'))
+        obj = PublicDefault.objects.create(is_public=True,
+            pub_date=self.past_date)
+        self.assertEqual(['sitemap-4.xml'], self.write())
+        self.assertEqual([self.url(obj)], self.read_urls('sitemap-4.xml'))
+
+    def read_all_urls(self):
+        urls = []
+        for shard_url in self.read_urls('sitemap.xml'):
+            urls.extend(self.read_urls(shard_url.split('/')[-1]))
+        return urls
+
+    def test_overflowing_shard(self):
+        self.write()
+        for obj in PublicDefault.objects.all():
+            self.publish(obj)
+        # only the first shard is split up, the others keep their files
+        self.assertEqual(
+            ['sitemap-1.xml', 'sitemap-4.xml', 'sitemap-5.xml'],
+            self.write())
+        self.assertEqual([
+            'http://example.com/sitemaps/sitemap-1.xml',
+            'http://example.com/sitemaps/sitemap-4.xml',
+            'http://example.com/sitemaps/sitemap-5.xml',
+            'http://example.com/sitemaps/sitemap-2.xml',
+            'http://example.com/sitemaps/sitemap-3.xml',
+        ], self.read_urls('sitemap.xml'))
+        self.assertEqual(
+            [self.url(obj) for obj in PublicDefault.objects.order_by('pk')],
+            self.read_all_urls())
+        self.assertEqual([], self.write())
+
+    def test_emptied_shard(self):
+        self.write()
+        PublicDefault.objects.filter(pk__in=[4, 5]).update(is_public=False)
+        self.assertEqual([], self.write())
+        self.assertFalse(os.path.exists(
+            os.path.join(self.directory, 'sitemap-1.xml')))
+        self.assertEqual([
+            'http://example.com/sitemaps/sitemap-2.xml',
+            'http://example.com/sitemaps/sitemap-3.xml',
+        ], self.read_urls('sitemap.xml'))
+        # the second shard took over the range of the first one
+        obj = PublicDefault.objects.get(pk=1)
+        self.publish(obj)
+        self.assertEqual(['sitemap-2.xml'], self.write())
+        self.assertEqual(
+            [self.url(obj) for obj in PublicDefault.generic.public()
+                .order_by('pk')],
+            self.read_all_urls())
+
+    def test_removed_shard(self):
+        self.write()
+        PublicDefault.generic.public().order_by('-pk')[0].delete()
+        self.assertEqual([], self.write())
+        self.assertFalse(os.path.exists(
+            os.path.join(self.directory, 'sitemap-3.xml')))
+        self.assertEqual(2, len(self.read_urls('sitemap.xml')))
+
+
+class TestPublicSitemapWatermark(TestCase):
+    past_date = datetime.now() - timedelta(1)
+    future_date = datetime.now() + timedelta(1)
+
+    def setUp(self):
+        # the shards are [1, 2], [4, 5] and [6, 7], the third object is
+        # scheduled and inside the range of the second shard
+        for pub_date in [self.past_date] * 2 + [self.future_date] + \
+                [self.past_date] * 4:
+            PublicModified.objects.create(pub_date=pub_date)
+        # keep the objects out of the window checked again by the next run
+        PublicModified.objects.update(
+            modified=datetime.now() - timedelta(1))
+        self.sitemap = ExampleSitemap(PublicModified.public,
+            modified_attr='modified')
+        self.directory = tempfile.mkdtemp()
+        self.write()
+        self.debug = settings.DEBUG
+        settings.DEBUG = True
+        connection.queries = []
+
+    def tearDown(self):
+        settings.DEBUG = self.debug
+        shutil.rmtree(self.directory)
+
+    def write(self):
+        return write_sitemap(self.sitemap, self.directory,
+            'http://example.com/sitemaps/')
+
+    def get_signature_queries(self):
+        return len([query for query in connection.queries
+            if 'SUM(' in query['sql']])
+
+    def test_unchanged(self):
+        self.assertEqual([], self.write())
+        self.assertEqual(0, self.get_signature_queries())
+
+    def test_modified_object(self):
+        obj = PublicModified.objects.get(pk=4)
+        obj.is_public = False
+        obj.save()
+        self.assertEqual(['sitemap-2.xml'], self.write())
+        self.assertEqual(1, self.get_signature_queries())
+
+    def test_swapped_objects(self):
+        obj = PublicModified.objects.get(pk=4)
+        obj.is_public = False
+        obj.save()
+        obj = PublicModified.objects.get(pk=3)
+        obj.pub_date = self.past_date
+        obj.save()
+        self.assertEqual(['sitemap-2.xml'], self.write())
+        self.assertEqual(1, self.get_signature_queries())
+
+    def test_late_commit(self):
+        # the object was saved before the last run started but committed
+        # after its shard was read
+        f = open(os.path.join(self.directory, 'sitemap.json'))
+        try:
+            since = datetime.strptime(simplejson.load(f)['since'],
+                '%Y-%m-%d %H:%M:%S.%f')
+        finally:
+            f.close()
+        modified = since + self.sitemap.watermark_lag - timedelta(seconds=1)
+        PublicModified.objects.filter(pk=3).update(pub_date=self.past_date,
+            modified=modified)
+        self.assertEqual(['sitemap-2.xml'], self.write())
+
+    def test_scheduled_object(self):
+        # ``update`` doesn't touch the modified field
+        PublicModified.objects.filter(pk=3).update(pub_date=datetime.now())
+        self.assertEqual(['sitemap-2.xml'], self.write())
+        self.assertEqual(1, self.get_signature_queries())
+
+    def test_deleted_object(self):
+        PublicModified.objects.filter(pk=1).delete()
+        self.assertEqual(['sitemap-1.xml'], self.write())
+        self.assertEqual(1, self.get_signature_queries())
+        self.assertEqual([], self.write())
+
+
+class ExampleFeed(PublicFeed):
+    manager = PublicDefault.public
+    title = 'Example'
+    link = '/example/'
+    description = 'Example feed'
+
+
+class TestPublicFeed(DefaultTestCase):
+    def test_items(self):
+        older = PublicDefault.objects.create(is_public=True,
+            pub_date=self.past_date - timedelta(1))
+        PublicDefault.objects.create(is_public=False,
+            pub_date=self.past_date)
+        feed = ExampleFeed()
+        self.assertEqual(
+            list(PublicDefault.public.order_by('-pub_date')),
+            list(feed.items()))
+        self.assertEqual(older, feed.items()[1])
+        feed.limit = 1
+        self.assertEqual(1, len(feed.items()))
+
+    def test_item_pubdate(self):
+        feed = ExampleFeed()
+        obj = feed.items()[0]
+        self.assertEqual(obj.pub_date, feed.item_pubdate(obj))
+
+
+class PublicDefaultAdmin(VisibilityAdminMixin, admin.ModelAdmin):
+    visibility_manager = 'generic'
+    list_filter = ('is_public',)
+    search_fields = ('tags__name',)
+
+
+class ChangeListTestMixin(object):
+    def get_changelist(self, **params):
+        request = HttpRequest()
+        request.GET.update(params)
+        model_admin = PublicDefaultAdmin(PublicDefault, admin.site)
+        ChangeList = model_admin.get_changelist(request)
+        return ChangeList(request, PublicDefault,
+            model_admin.list_display, model_admin.list_display_links,
+            model_admin.list_filter, model_admin.date_hierarchy,
+            model_admin.search_fields, model_admin.list_select_related,
+            model_admin.list_per_page, model_admin.list_editable,
+            model_admin)
+
+    def get_choices(self, cl):
+        spec = cl.filter_specs[0]
+        self.assertTrue(isinstance(spec, VisibilityFilterSpec))
+        return [(choice['display'], choice['selected'])
+            for choice in spec.choices(cl)]
+
+
+class TestVisibilityAdmin(ChangeListTestMixin, DefaultTestCase):
+    def test_changelist(self):
+        cl = self.get_changelist()
+        self.assertTrue(isinstance(cl, VisibilityChangeList))
+        self.assertEqual(4, cl.result_count)
+        self.assertEqual(2, len(cl.filter_specs))
+        self.assertEqual([
+            (u'All', True),
+            (u'public (1)', False),
+            (u'scheduled (1)', False),
+            (u'hidden (2)', False),
+        ], self.get_choices(cl))
+
+    def test_filtered_changelist(self):
+        cl = self.get_changelist(visibility='scheduled')
+        self.assertEqual(
+            list(PublicDefault.generic.scheduled()),
+            list(cl.result_list))
+        self.assertEqual(4, cl.full_result_count)
+        self.assertEqual([
+            (u'All', False),
+            (u'public (1)', False),
+            (u'scheduled (1)', True),
+            (u'hidden (2)', False),
+        ], self.get_choices(cl))
+        self.assertTrue('visibility=scheduled' in cl.get_query_string())
+
+    def test_combined_filters(self):
+        cl = self.get_changelist(visibility='hidden', is_public='1')
+        self.assertEqual(0, cl.result_count)
+        self.assertEqual([
+            (u'All', False),
+            (u'public (1)', False),
+            (u'scheduled (1)', False),
+            (u'hidden (0)', True),
+        ], self.get_choices(cl))
+
+    def test_related_search(self):
+        for obj in PublicDefault.objects.all():
+            Tag.objects.create(name='tag a', obj=obj)
+            Tag.objects.create(name='tag b', obj=obj)
+        cl = self.get_changelist(q='tag')
+        self.assertEqual(4, cl.result_count)
+        self.assertEqual([
+            (u'All', True),
+            (u'public (1)', False),
+            (u'scheduled (1)', False),
+            (u'hidden (2)', False),
+        ], self.get_choices(cl))
+
+    def test_invalid_visibility(self):
+        self.assertRaises(IncorrectLookupParameters,
+            self.get_changelist, visibility='unknown')
+
+    def test_default_manager(self):
+        model_admin = PublicDefaultAdmin(PublicDefault, admin.site)
+        model_admin.visibility_manager = None
+        self.assertRaises(ImproperlyConfigured,
+            model_admin.queryset, HttpRequest())
+
+    def test_estimate_fallback(self):
+        model_admin = PublicDefaultAdmin(PublicDefault, admin.site)
+        model_admin.visibility_estimate = True
+        counts, estimated = model_admin.get_visibility_counts(
+            PublicDefault.generic.all())
+        self.assertFalse(estimated)
+        self.assertEqual(PublicDefault.generic.visibility_counts(), counts)
+
+
+class ExplainCursor(object):
+    def __init__(self, plan):
+        self.plan = plan
+        self.executed = []
+
+    def execute(self, sql, params):
+        self.executed.append(sql)
+
+    def fetchone(self):
+        return (self.plan,)
+
+
+class PostgresConnection(object):
+    settings_dict = {'ENGINE': 'django.db.backends.postgresql_psycopg2'}
+
+    def __init__(self, plan):
+        self.cursor_instance = ExplainCursor(plan)
+
+    def cursor(self):
+        return self.cursor_instance
+
+
+class TestVisibilityEstimate(ChangeListTestMixin, DefaultTestCase):
+    plan = ('Seq Scan on manager_tests_publicdefault  '
+        '(cost=0.00..1.04 rows=7 width=17)')
+
+    def setUp(self):
+        super(TestVisibilityEstimate, self).setUp()
+        self.connections = publicmanager_admin.connections
+        self.connection = PostgresConnection(self.plan)
+        publicmanager_admin.connections = {'default': self.connection}
+        PublicDefaultAdmin.visibility_estimate = True
+
+    def tearDown(self):
+        publicmanager_admin.connections = self.connections
+        del PublicDefaultAdmin.visibility_estimate
+
+    def test_estimate_count(self):
+        self.assertEqual(7, estimate_count(PublicDefault.generic.public()))
+        self.assertTrue(
+            self.connection.cursor_instance.executed[0].startswith('EXPLAIN '))
+
+    def test_empty_queryset(self):
+        self.assertEqual(0, estimate_count(IsPublic.generic.scheduled()))
+        self.assertEqual(0,
+            estimate_count(PublicDefault.generic.filter(pk__in=[])))
+        self.assertEqual([], self.connection.cursor_instance.executed)
+
+    def test_unknown_plan(self):
+        self.connection.cursor_instance.plan = 'Result'
+        self.assertEqual(None, estimate_count(PublicDefault.generic.all()))
+
+    def test_get_visibility_counts(self):
+        model_admin = PublicDefaultAdmin(PublicDefault, admin.site)
+        self.assertEqual(
+            ({'public': 7, 'scheduled': 7, 'hidden': 7}, True),
+            model_admin.get_visibility_counts(PublicDefault.generic.all()))
+
+    def test_changelist(self):
+        cl = self.get_changelist()
+        self.assertEqual([
+            (u'All', True),
+            (u'public (~7)', False),
+            (u'scheduled (~7)', False),
+            (u'hidden (~7)', False),
+        ], self.get_choices(cl))
+
+    def test_estimate_fallback(self):
+        self.connection.cursor_instance.plan = 'Result'
+        model_admin = PublicDefaultAdmin(PublicDefault, admin.site)
+        counts, estimated = model_admin.get_visibility_counts(
+            PublicDefault.generic.all())
+        self.assertFalse(estimated)
+        self.assertEqual(PublicDefault.generic.visibility_counts(), counts)